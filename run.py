@@ -1,110 +1,334 @@
+import copy
+import json
 import sqlite3
+import time
+from types import SimpleNamespace
 
-import folium
-import geopandas as gpd
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import requests
 import streamlit as st
-from folium.plugins import Geocoder, MiniMap, Fullscreen, Draw
-from streamlit_folium import st_folium
 
 st.set_page_config(page_title="🌍 World Countries App", layout="wide")
 
 
+@st.cache_resource
+def get_conn():
+    # shared read-only connection; countries.db ships with the covering index
+    # idx_ind_cc_ind_yr (country_code, indicator, year) and ANALYZE stats
+    conn = sqlite3.connect("file:countries.db?mode=ro",
+                           uri=True, check_same_thread=False)
+    for pragma in ("PRAGMA temp_store=MEMORY", "PRAGMA mmap_size=268435456", "PRAGMA cache_size=-65536"):
+        conn.execute(pragma)
+    return conn
+
+
 @st.cache_data
 def load_data():
-    with sqlite3.connect("countries.db") as conn:
-        df = pd.read_sql_query("SELECT * FROM countries", conn)
+    df = pd.read_sql_query("SELECT * FROM countries", get_conn())
     # safety: ensure columns exist
     for c in ["capital", "population", "area", "language_count", "cca3", "cca2", "name_common", "region", "subregion"]:
         if c not in df.columns:
             df[c] = None
-
-    df['capital_length'] = df['capital'].apply(lambda x: len(
-        x) if isinstance(x, str) else (len(x) if isinstance(x, list) else 0))
-    df['capital_length_cat'] = pd.cut(df['capital_length'], bins=[-1, 5, 10, 15, 20, 100],
-                                      labels=['0-5', '6-10', '11-15', '16-20', '20+'])
-    # avoid division by zero
-    df['area'] = df['area'].replace({0: pd.NA}).astype(float)
-    df['population'] = df['population'].astype(float)
-    df['density'] = df['population'] / df['area']
+    # numeric dtypes after the safety fill, so a column filled with None still gets one;
+    # area fits float32, population stays float64 (float32 would round large counts)
+    df = df.astype({"population": "float64", "area": "float32"})
+    df['language_count'] = pd.to_numeric(df['language_count']).fillna(0).astype('int16')
+
+    # vectorized string length kernel, missing capitals count as 0
+    df['capital_length'] = df['capital'].fillna('').str.len().astype('int16')
+    # only the length is used; capitals in the UI come from REST Countries
+    df = df.drop(columns='capital')
+    # bucket per length from the upper bin edges; bins are right-inclusive (5 -> '0-5')
+    codes = np.searchsorted(np.array([5, 10, 15, 20], dtype=np.int16),
+                            df['capital_length'].to_numpy(), side='left')
+    df['capital_length_cat'] = pd.Categorical.from_codes(
+        codes, categories=['0-5', '6-10', '11-15', '16-20', '20+'], ordered=True)
+    # zero area means missing: shown as '—' and kept off the log-log scatter
+    df.loc[df['area'] == 0, 'area'] = np.nan
+    # people per km², float32; NaN where area is missing or zero
+    pop = df['population'].to_numpy(dtype='float32')
+    area = df['area'].to_numpy()
+    df['density'] = np.divide(pop, area, out=np.full_like(pop, np.nan), where=area > 0)
+    # low-cardinality labels as category: int codes for groupby, smaller cache/serialization
+    for c in ('region', 'subregion', 'cca2', 'cca3'):
+        df[c] = df[c].astype('category')
     return df
 
 
 @st.cache_data
-def load_geojson():
+def load_geojson(tolerance=0.05):
+    # geopandas (pyproj, shapely) is slow to import: only pay for it where maps are drawn
+    import geopandas as gpd
+
+    # world.parquet is world.geojson converted once with
+    # gpd.read_file("world.geojson").to_parquet("world.parquet"): WKB columns load without JSON parsing
     try:
-        return gpd.read_file("world.geojson")
+        gdf = gpd.read_parquet("world.parquet").set_index("iso_a3", drop=False)
     except Exception:
         return gpd.GeoDataFrame()
+    # fewer vertices -> smaller GeoJson payload embedded in every folium map;
+    # tolerance is in degrees, pick it for the map's zoom level (cached per value)
+    gdf['geometry'] = gdf.geometry.simplify(tolerance, preserve_topology=True)
+    return gdf
 
 
 @st.cache_data
+def get_country_geo(cca3):
+    # boundary GeoJSON + map center for one country, looked up by index and cached per country
+    geo_data = load_geojson()
+    if cca3 not in geo_data.index:
+        return None
+    geo_match = geo_data.loc[[cca3]]
+    # map center: a point guaranteed to lie inside the boundary
+    point = geo_match.geometry.iloc[0].representative_point()
+    return {"geojson": geo_match.__geo_interface__, "center": (point.y, point.x)}
+
+
+@st.cache_data
+def get_countries_geo(cca3_tuple):
+    # boundary GeoJSON, bounds and tooltip fields for the Compare map selection; the map fits
+    # its bounds to the selection, so it uses the same tolerance as the details map
+    geo_data = load_geojson()
+    geo_sel = geo_data.loc[geo_data.index.intersection(cca3_tuple)]
+    if geo_sel.empty:
+        return None
+    return {
+        "geojson": geo_sel.__geo_interface__,
+        "bounds": tuple(float(b) for b in geo_sel.total_bounds),
+        "tooltip_fields": ['name'] if 'name' in geo_sel.columns else [],
+    }
+
+
+@st.cache_resource
+def get_http_session():
+    # one keep-alive session so TCP/TLS handshakes are reused across requests
+    return requests.Session()
+
+
+# REST Countries records persisted on disk: cca3 -> json, fetched_at
+REST_CACHE_DB = "rest_cache.sqlite"
+REST_CACHE_TTL = 30 * 24 * 3600
+
+
+def read_rest_cache(cca3):
+    try:
+        with sqlite3.connect(REST_CACHE_DB) as conn:
+            row = conn.execute(
+                "SELECT json, fetched_at FROM country_json WHERE cca3 = ?", (cca3,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if row and time.time() - row[1] < REST_CACHE_TTL:
+        return json.loads(row[0])
+    return None
+
+
+def write_rest_cache(countries):
+    # countries: {cca3: restcountries record}
+    now = time.time()
+    try:
+        with sqlite3.connect(REST_CACHE_DB) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS country_json (cca3 TEXT PRIMARY KEY, json TEXT, fetched_at REAL)")
+            conn.executemany("INSERT OR REPLACE INTO country_json VALUES (?, ?, ?)",
+                             [(cca3, json.dumps(data), now) for cca3, data in countries.items()])
+    except sqlite3.Error:
+        pass
+
+
+# fields the app reads from a restcountries record; /all accepts at most 10 fields per call,
+# so they are requested in groups (each with cca3 as the merge key)
+REST_ALL_FIELDS = [
+    ["name", "region", "subregion", "area", "continents", "capital", "capitalInfo", "flags", "coatOfArms"],
+    ["currencies", "languages", "timezones", "tld", "fifa", "independent", "unMember", "startOfWeek", "borders"],
+    ["gini"],
+]
+
+
+# seconds per-country lookups skip /all after it failed
+REST_ALL_RETRY_AFTER = 300
+
+
+@st.cache_resource
+def rest_all_status():
+    # shared across sessions: when the last /all fetch failed
+    return {"failed_at": 0.0}
+
+
+@st.cache_data(ttl="1d")
+def all_countries():
+    # cca3 -> restcountries record for every country, merged from the REST_ALL_FIELDS groups
+    countries = {}
+    for fields in REST_ALL_FIELDS:
+        response = get_http_session().get("https://restcountries.com/v3.1/all",
+                                          params={"fields": ",".join(["cca3"] + fields)}, timeout=10)
+        response.raise_for_status()
+        for record in response.json():
+            countries.setdefault(record["cca3"], {}).update(record)
+    write_rest_cache(countries)
+    return countries
+
+
+# restcountries record for one country: disk cache, then the /all dict, then /alpha/{cca3}
+@st.cache_data(ttl="7d", max_entries=300)
 def get_country_data_by_cca3(cca3):
+    cached = read_rest_cache(cca3)
+    if cached is not None:
+        return cached
+    data = None
+    status = rest_all_status()
+    if time.time() - status["failed_at"] >= REST_ALL_RETRY_AFTER:
+        try:
+            data = all_countries().get(cca3)
+        except Exception:
+            # failures aren't cached by st.cache_data; remember it so other lookups go straight to /alpha
+            status["failed_at"] = time.time()
+    if data:
+        return data
+    # single-country endpoint as a fallback if the bulk fetch failed or misses this code
     try:
-        response = requests.get(
+        response = get_http_session().get(
             f"https://restcountries.com/v3.1/alpha/{cca3}", timeout=10)
         if response.status_code == 200:
-            return response.json()[0]
+            data = response.json()[0]
+            write_rest_cache({cca3: data})
+            return data
     except Exception:
         return None
     return None
 
 
+@st.cache_resource
+def load_all_indicators():
+    # whole indicators table indexed by (country_code, indicator), rows ordered by year; shared
+    # read-only (callers slice it), value kept float64 for the full-integer cards
+    return pd.read_sql_query(
+        "SELECT country_code, indicator, year, value FROM indicators ORDER BY country_code, indicator, year",
+        get_conn(), dtype={"indicator": "category", "year": "int16"}).set_index(["country_code", "indicator"])
+
+
 @st.cache_data
 def load_worldbank_from_db(cca2):
+    # one country's indicator, year, value rows
     try:
-        with sqlite3.connect("countries.db") as conn:
-            df = pd.read_sql_query(
-                f"SELECT * FROM indicators WHERE country_code = '{cca2}'", conn)
-        return df
+        return load_all_indicators().loc[cca2].reset_index()
     except Exception:
         return pd.DataFrame()
 
 
-# ---------------------- load static datasets ----------------------
+@st.cache_data
+def load_worldbank_bulk(cca2_tuple):
+    # indicator rows for all selected countries, ordered by country_code, indicator, year
+    if not cca2_tuple:
+        return pd.DataFrame()
+    placeholders = ','.join('?' * len(cca2_tuple))
+    try:
+        return pd.read_sql_query(
+            f"SELECT country_code, indicator, year, value FROM indicators WHERE country_code IN ({placeholders}) "
+            "ORDER BY country_code, indicator, year", get_conn(), params=cca2_tuple,
+            dtype={"country_code": "category", "indicator": "category", "year": "int16"})
+    except Exception:
+        return pd.DataFrame()
 
-df = load_data()
-geo_data = load_geojson()
 
-# helper maps
-card_indicators = [
-    "gdp_current_usd", "gdp_per_capita", "gdp_growth_percent", "inflation_percent",
-    "unemployment_percent", "population_total", "imports_usd", "exports_usd"
-]
+@st.cache_data
+def load_indicator_series(cca2_tuple):
+    # indicator -> (country_code, year, value, country_name) rows, ordered by country_code, year
+    wb = load_worldbank_bulk(cca2_tuple)
+    if wb.empty:
+        return {}
+    # legend names for the whole selection
+    wb = wb.assign(country_name=wb['country_code'].map(CCA2_TO_NAME))
+    return {ind: chart_df.reset_index(drop=True)
+            for ind, chart_df in wb.groupby('indicator', sort=False, observed=True)}
 
-card_titles = {
-    'gdp_current_usd': '💰 ВВП (USD)',
-    'population_total': '👥 Население',
-    'gdp_per_capita': '👤 ВВП на душу',
-    'gdp_growth_percent': '📈 Рост ВВП (%)',
-    'inflation_percent': '🔥 Инфляция (%)',
-    'unemployment_percent': '📉 Безработица (%)',
-    'imports_usd': '📦 Импорт (USD)',
-    'exports_usd': '🚢 Экспорт (USD)'
-}
 
-# Top navigation using tabs (appears at the top)
-tabs = st.tabs(["Compare Countries", "Country Details", "Dashboard"])
+@st.cache_data
+def load_gdp_growth(cca2_tuple):
+    # GDP per year with % change vs previous year, computed by a window function in SQLite
+    if not cca2_tuple:
+        return pd.DataFrame()
+    placeholders = ','.join('?' * len(cca2_tuple))
+    query = f"""
+        SELECT country_code, year, value,
+               (value / LAG(value) OVER (PARTITION BY country_code ORDER BY year) - 1) * 100 AS pct_change
+        FROM indicators
+        WHERE indicator = 'gdp_current_usd' AND country_code IN ({placeholders})
+        ORDER BY country_code, year
+    """
+    try:
+        return pd.read_sql_query(query, get_conn(), params=cca2_tuple, dtype={"year": "int16"})
+    except Exception:
+        return pd.DataFrame()
 
-# small header row with DM link
-st.markdown("[DM me on Telegram](https://t.me/Hopxol)")
 
-# ---------------------------- Dashboard (original) ----------------------------
-with tabs[2]:
-    st.title("📊 Дашборд по странам мира")
-    st.markdown("""
-    Этот дашборд использует данные из REST Countries API и визуализирует различные метрики:
-    - 📌 Население
-    - 🗺️ География
-    - 🗣️ Языки
-    - 🌐 Регионы и субрегионы
-    """)
+@st.cache_data
+def latest_indicators(cca2_tuple, indicators):
+    # latest-year value per (country, indicator) in one indexed GROUP BY, returned as indicator x country
+    if not cca2_tuple or not indicators:
+        return pd.DataFrame()
+    cc_ph = ','.join('?' * len(cca2_tuple))
+    ind_ph = ','.join('?' * len(indicators))
+    query = f"""
+        SELECT i.country_code, i.indicator, i.value
+        FROM indicators i
+        JOIN (SELECT country_code, indicator, MAX(year) AS year
+              FROM indicators
+              WHERE country_code IN ({cc_ph}) AND indicator IN ({ind_ph})
+              GROUP BY country_code, indicator) m
+        USING (country_code, indicator, year)
+    """
+    try:
+        latest = pd.read_sql_query(
+            query, get_conn(), params=tuple(cca2_tuple) + tuple(indicators))
+    except Exception:
+        return pd.DataFrame()
+    return latest.pivot(index='indicator', columns='country_code', values='value')
+
+
+@st.cache_data
+def dashboard_aggs():
+    # tables behind the Dashboard charts, from the static countries table
+    d = load_data()
+
+    subregions = d['subregion'].value_counts().nlargest(10).reset_index()
+    subregions.columns = ['Субрегион', 'Количество стран']
+
+    # country count and average language count per region
+    region_stats = d.groupby('region', observed=True).agg(
+        count=('cca3', 'size'), avg_lang=('language_count', 'mean'))
+
+    region_counts = region_stats['count'].sort_values(
+        ascending=False, kind='stable').reset_index()
+    region_counts.columns = ['Регион', 'Количество стран']
+
+    avg_lang = region_stats['avg_lang'].round(
+        1).rename('language_count').reset_index()
+
+    # per-code counts of the ordered categorical, already in bucket order (empty buckets kept as 0)
+    cap_len = d.groupby('capital_length_cat', observed=False).size().reset_index()
+    cap_len.columns = ['Категория длины столицы', 'Количество стран']
+
+    return SimpleNamespace(
+        subregions=subregions,
+        top_lang=d.nlargest(15, 'language_count'),
+        region_counts=region_counts,
+        top20=d.nlargest(20, 'population'),
+        avg_lang=avg_lang,
+        cap_len=cap_len,
+    )
+
+
+@st.cache_resource
+def build_dashboard_figs():
+    # (map figure, [(title, figure)]) for the Dashboard; shared, st.plotly_chart only reads them
+    d = load_data()
+    aggs = dashboard_aggs()
 
     map_fig = px.choropleth(
-        df,
+        d,
         locations="cca3",
         color="population",
         hover_name="name_common",
@@ -112,55 +336,174 @@ with tabs[2]:
         title="🗺️ Население по странам",
         labels={"population": "Население"}
     )
-    st.plotly_chart(map_fig, use_container_width=True)
-    st.markdown("---")
 
-    # Multiple charts (kept from your original layout)
     charts = []
 
-    subregions = df['subregion'].value_counts().nlargest(10).reset_index()
-    subregions.columns = ['Субрегион', 'Количество стран']
-    fig1 = px.bar(subregions, x='Количество стран',
+    fig1 = px.bar(aggs.subregions, x='Количество стран',
                   y='Субрегион', orientation='h', color='Субрегион')
     charts.append(("🌍 Топ-10 субрегионов", fig1))
 
-    fig2 = px.scatter(df, x='area', y='population',
+    fig2 = px.scatter(d, x='area', y='population',
                       log_x=True, log_y=True, color='region')
     charts.append(("📏 Площадь vs Население", fig2))
 
-    top_lang = df.sort_values(by='language_count', ascending=False).head(15)
-    fig3 = px.bar(top_lang, x='language_count', y='name_common',
+    fig3 = px.bar(aggs.top_lang, x='language_count', y='name_common',
                   orientation='h', color='name_common')
     charts.append(("🗣️ Топ-15 по языкам", fig3))
 
-    region_counts = df['region'].value_counts().reset_index()
-    region_counts.columns = ['Регион', 'Количество стран']
-    fig5 = px.bar(region_counts, x='Количество стран',
+    fig5 = px.bar(aggs.region_counts, x='Количество стран',
                   y='Регион', orientation='h', color='Регион')
     charts.append(("🗺️ Страны по регионам", fig5))
 
-    top20 = df.sort_values(by='population', ascending=False).head(20)
-    fig6 = px.bar(top20, x='population', y='name_common',
+    fig6 = px.bar(aggs.top20, x='population', y='name_common',
                   orientation='h', color='name_common')
     charts.append(("🏙️ Топ-20 по населению", fig6))
 
-    fig7 = px.pie(region_counts, names='Регион',
+    fig7 = px.pie(aggs.region_counts, names='Регион',
                   values='Количество стран', hole=0.3)
     charts.append(("🌐 Доля регионов", fig7))
 
-    avg_lang = df.groupby('region')['language_count'].mean().reset_index()
-    avg_lang['language_count'] = avg_lang['language_count'].round(1)
-    fig8 = px.bar(avg_lang, x='language_count', y='region',
+    fig8 = px.bar(aggs.avg_lang, x='language_count', y='region',
                   orientation='h', color='region')
     charts.append(("🗣️ Среднее языков по регионам", fig8))
 
-    cap_len = df['capital_length_cat'].value_counts(
-    ).sort_index().reset_index()
-    cap_len.columns = ['Категория длины столицы', 'Количество стран']
-    fig9 = px.bar(cap_len, x='Категория длины столицы',
+    fig9 = px.bar(aggs.cap_len, x='Категория длины столицы',
                   y='Количество стран', color='Категория длины столицы')
     charts.append(("🏛️ Длина названий столиц", fig9))
 
+    return map_fig, charts
+
+
+# ---------------------- load static datasets ----------------------
+
+df = load_data()
+
+# per-country lookups keyed by cca3 / cca2
+CCA3_TO_NAME = df.set_index('cca3')['name_common'].to_dict()
+CCA3_TO_CCA2 = df.set_index('cca3')['cca2'].to_dict()
+CCA3_TO_AREA = df.set_index('cca3')['area'].to_dict()
+CCA2_TO_NAME = df.set_index('cca2')['name_common'].to_dict()
+
+# country picker options: names sorted alphabetically, and name -> cca3
+_named = df[['name_common', 'cca3']].dropna().sort_values(by='name_common')
+COUNTRY_NAMES = _named['name_common'].tolist()
+NAME_TO_CCA3 = dict(zip(_named['name_common'], _named['cca3']))
+
+# helper maps
+card_indicators = [
+    "gdp_current_usd", "gdp_per_capita", "gdp_growth_percent", "inflation_percent",
+    "unemployment_percent", "population_total", "imports_usd", "exports_usd"
+]
+
+card_titles = {
+    'gdp_current_usd': '💰 ВВП (USD)',
+    'population_total': '👥 Население',
+    'gdp_per_capita': '👤 ВВП на душу',
+    'gdp_growth_percent': '📈 Рост ВВП (%)',
+    'inflation_percent': '🔥 Инфляция (%)',
+    'unemployment_percent': '📉 Безработица (%)',
+    'imports_usd': '📦 Импорт (USD)',
+    'exports_usd': '🚢 Экспорт (USD)'
+}
+
+indicator_titles = {
+    'gdp_current_usd': '💰 ВВП (текущий, USD)',
+    'gdp_per_capita': '👤 ВВП на душу населения',
+    'gdp_growth_percent': '📈 Рост ВВП (%)',
+    'inflation_percent': '🔥 Инфляция (%)',
+    'unemployment_percent': '📉 Безработица (%)',
+    'population_total': '👥 Население',
+    'imports_usd': '📦 Импорт (USD)',
+    'exports_usd': '🚢 Экспорт (USD)',
+    'exports_pct_gdp': '📊 Экспорт (% ВВП)',
+    'imports_pct_gdp': '📊 Импорт (% ВВП)',
+    'current_account_pct_gdp': '💼 Текущий счёт (% ВВП)',
+    'capital_formation_pct_gdp': '🏗️ Капитальные вложения (% ВВП)',
+    'govt_expenditure_pct_gdp': '🏛️ Госрасходы (% ВВП)'
+}
+# display position of each indicator; chart lists are sorted by it
+indicator_order = {ind: pos for pos, ind in enumerate(indicator_titles)}
+
+
+def render_indicator(chart_df, indicator, title):
+    # one indicator chart (subheader + plotly figure) into the current column
+    st.subheader(title)
+    # choose visual type per indicator
+    if indicator in ['gdp_growth_percent', 'inflation_percent', 'unemployment_percent']:
+        fig = px.bar(
+            chart_df, x="year", y="value", text="value", title=title)
+    elif indicator in ['population_total']:
+        fig = px.area(chart_df, x="year",
+                      y="value", title=title)
+    elif indicator in ['exports_pct_gdp', 'imports_pct_gdp']:
+        fig = px.scatter(
+            chart_df, x="year", y="value", title=title)
+    else:
+        fig = px.line(
+            chart_df, x="year", y="value", markers=True, title=title)
+
+    try:
+        fig.update_traces(
+            texttemplate='%{text:.2s}', textposition='top center')
+    except Exception:
+        pass
+
+    fig.update_layout(yaxis_title="Значение", xaxis_title="Год", height=350, margin=dict(
+        t=10), hovermode='x unified')
+    st.plotly_chart(fig, use_container_width=True)
+
+
+def build_country_map(cca3, country):
+    # folium map with the country boundary, capital marker and plugins; None without geometry
+    import folium
+    from folium.plugins import Geocoder, MiniMap, Fullscreen, Draw
+
+    country_geo = get_country_geo(cca3)
+    if not country_geo:
+        return None
+    center_lat, center_lon = country_geo["center"]
+    fmap = folium.Map(location=[center_lat, center_lon], zoom_start=5)
+    folium.GeoJson(country_geo["geojson"], name="Границы страны").add_to(fmap)
+
+    capital_coord = country.get("capitalInfo", {}).get("latlng", None)
+    capital_name = ", ".join(country.get(
+        "capital", [])) if country.get("capital") else '—'
+    if capital_coord:
+        folium.Marker(location=capital_coord, popup=f"Capital: {capital_name}", icon=folium.Icon(
+            color="green", icon="flag")).add_to(fmap)
+    else:
+        folium.Marker(location=[center_lat, center_lon], popup=f"Capital (approx.): {capital_name}", icon=folium.Icon(
+            color="gray", icon="question-sign")).add_to(fmap)
+
+    Geocoder().add_to(fmap)
+    Fullscreen().add_to(fmap)
+    Draw(export=False).add_to(fmap)
+    MiniMap(position="bottomright").add_to(fmap)
+    return fmap
+
+
+# Top navigation using tabs (appears at the top)
+tabs = st.tabs(["Compare Countries", "Country Details", "Dashboard"])
+
+# small header row with DM link
+st.markdown("[DM me on Telegram](https://t.me/Hopxol)")
+
+# ---------------------------- Dashboard (original) ----------------------------
+with tabs[2]:
+    st.title("📊 Дашборд по странам мира")
+    st.markdown("""
+    Этот дашборд использует данные из REST Countries API и визуализирует различные метрики:
+    - 📌 Население
+    - 🗺️ География
+    - 🗣️ Языки
+    - 🌐 Регионы и субрегионы
+    """)
+
+    map_fig, charts = build_dashboard_figs()
+    st.plotly_chart(map_fig, use_container_width=True)
+    st.markdown("---")
+
+    # Multiple charts (kept from your original layout)
     for i in range(0, len(charts), 2):
         cols = st.columns(2)
         for j in range(2):
@@ -173,20 +516,17 @@ with tabs[2]:
     st.markdown("with love 💘 by Behzod Khidirov.")
 
 # ---------------------------- Country Details (updated) ----------------------------
-with tabs[1]:
+@st.fragment
+def render_country_details():
+    # fragment: switching the country reruns only this tab, not the Dashboard and Compare sections
     st.title("📊 Дашборд по странам мира | 🌐 Детали по стране")
     
-    df_sorted = df.sort_values(by='name_common')
-    country_options = df_sorted[['name_common', 'cca3']].dropna()
+    default_country = 'Netherlands' if 'Netherlands' in NAME_TO_CCA3 else COUNTRY_NAMES[0]
+    selected_country_name = st.selectbox("Выберите страну", COUNTRY_NAMES,
+                                         index=COUNTRY_NAMES.index(default_country))
 
-    default_country = 'Netherlands' if 'Netherlands' in country_options[
-        'name_common'].values else country_options['name_common'].iloc[0]
-    selected_country_name = st.selectbox("Выберите страну", country_options['name_common'].tolist(),
-                                         index=country_options['name_common'].tolist().index(default_country))
-
-    selected_cca3 = country_options[country_options['name_common']
-                                    == selected_country_name]['cca3'].values[0]
-    selected_cca2 = df[df['cca3'] == selected_cca3]['cca2'].values[0]
+    selected_cca3 = NAME_TO_CCA3[selected_country_name]
+    selected_cca2 = CCA3_TO_CCA2[selected_cca3]
     country = get_country_data_by_cca3(selected_cca3)
 
     if not country:
@@ -197,11 +537,12 @@ with tabs[1]:
 
     # Cards (same layout as your original single-country page)
     if not wb_data.empty:
+        # rows are ordered by indicator, year: last value per group is the latest year
+        latest_map = wb_data.groupby(
+            'indicator', sort=False, observed=True)['value'].last().to_dict()
         card_cols = st.columns(4)
         for i, indicator in enumerate(card_indicators):
-            latest = wb_data[(wb_data['indicator'] == indicator)
-                             ].sort_values('year')
-            value = latest.iloc[-1]['value'] if not latest.empty else None
+            value = latest_map.get(indicator)
             label = card_titles.get(indicator, indicator)
             if value is not None:
                 with card_cols[i % 4]:
@@ -263,7 +604,7 @@ with tabs[1]:
     # single-country GDP + pct change
     try:
         gdp_df = wb_data[wb_data['indicator'] == 'gdp_current_usd'][[
-            'year', 'value']].sort_values('year')
+            'year', 'value']]
         if not gdp_df.empty:
             gdp_df = gdp_df.set_index('year')
             gdp = gdp_df['value']
@@ -292,98 +633,49 @@ with tabs[1]:
         st.info('Ошибка при построении ВВП графика для этой страны.')
     st.markdown("---")
     if not wb_data.empty:
-        indicators_list = wb_data['indicator'].unique()
+        # rows are ordered by indicator, year: one groupby yields every year-sorted slice
+        chart_groups = dict(iter(wb_data.groupby('indicator', sort=False, observed=True)))
+        indicators_list = sorted(chart_groups,
+                                 key=lambda ind: indicator_order.get(ind, len(indicator_order)))
         for i in range(0, len(indicators_list), 3):
             cols = st.columns(3)
             for j in range(3):
                 if i + j < len(indicators_list):
                     indicator = indicators_list[i + j]
-                    chart_df = wb_data[wb_data['indicator']
-                                       == indicator].sort_values('year')
+                    chart_df = chart_groups[indicator]
                     if not chart_df.empty:
-                        title_map = {
-                            'gdp_current_usd': '💰 ВВП (текущий, USD)',
-                            'gdp_per_capita': '👤 ВВП на душу населения',
-                            'gdp_growth_percent': '📈 Рост ВВП (%)',
-                            'inflation_percent': '🔥 Инфляция (%)',
-                            'unemployment_percent': '📉 Безработица (%)',
-                            'population_total': '👥 Население',
-                            'imports_usd': '📦 Импорт (USD)',
-                            'exports_usd': '🚢 Экспорт (USD)',
-                            'exports_pct_gdp': '📊 Экспорт (% ВВП)',
-                            'imports_pct_gdp': '📊 Импорт (% ВВП)',
-                            'current_account_pct_gdp': '💼 Текущий счёт (% ВВП)',
-                            'capital_formation_pct_gdp': '🏗️ Капитальные вложения (% ВВП)',
-                            'govt_expenditure_pct_gdp': '🏛️ Госрасходы (% ВВП)'
-                        }
-                        title = title_map.get(
+                        title = indicator_titles.get(
                             indicator, indicator.replace('_', ' ').capitalize())
                         with cols[j]:
-                            st.subheader(title)
-                            # choose visual type per indicator
-                            if indicator in ['gdp_growth_percent', 'inflation_percent', 'unemployment_percent']:
-                                fig = px.bar(
-                                    chart_df, x="year", y="value", text="value", title=title)
-                            elif indicator in ['population_total']:
-                                fig = px.area(chart_df, x="year",
-                                              y="value", title=title)
-                            elif indicator in ['exports_pct_gdp', 'imports_pct_gdp']:
-                                fig = px.scatter(
-                                    chart_df, x="year", y="value", title=title)
-                            else:
-                                fig = px.line(
-                                    chart_df, x="year", y="value", markers=True, title=title)
-
-                            try:
-                                fig.update_traces(
-                                    texttemplate='%{text:.2s}', textposition='top center')
-                            except Exception:
-                                pass
-
-                            fig.update_layout(yaxis_title="Значение", xaxis_title="Год", height=350, margin=dict(
-                                t=10), hovermode='x unified')
-                            st.plotly_chart(fig, use_container_width=True)
+                            render_indicator(chart_df, indicator, title)
     else:
         st.info("Нет доступных данных для выбранной страны.")
     st.markdown("---")
 
     # Single-country map (similar to compare map)
     st.subheader('🗺️ Карта — границы и столица')
-    geo_match = geo_data[geo_data["iso_a3"] == selected_cca3]
-    if not geo_match.empty:
-        geo_match_projected = geo_match.to_crs(epsg=3857)
-        centroid_projected = geo_match_projected.geometry.centroid.iloc[0]
-        
-        # Convert the Point to a GeoSeries to use to_crs
-        centroid_geo = gpd.GeoSeries([centroid_projected], crs="EPSG:3857").to_crs(epsg=4326).iloc[0]
-        
-        # Use the re-projected centroid coordinates for the map
-        fmap = folium.Map(location=[centroid_geo.y, centroid_geo.x], zoom_start=5)
-        
-        # Use the original geometry in EPSG:4326 for GeoJson
-        geo_match = geo_match.to_crs(epsg=4326)
-        folium.GeoJson(geo_match, name="Границы страны").add_to(fmap)
-        
-        capital_coord = country.get("capitalInfo", {}).get("latlng", None)
-        capital_name = ", ".join(country.get(
-            "capital", [])) if country.get("capital") else '—'
-        if capital_coord:
-            folium.Marker(location=capital_coord, popup=f"Capital: {capital_name}", icon=folium.Icon(
-                color="green", icon="flag")).add_to(fmap)
+    # folium import, GeoJSON and Leaflet serialization only happen when the user asks for the map
+    if st.toggle("Показать карту границ", value=False, key="show_country_map"):
+        from streamlit_folium import st_folium
+
+        # a Map is per-session state: rebuild it only when the selected country changes
+        if st.session_state.get('map_cca3') != selected_cca3:
+            st.session_state['map_obj'] = build_country_map(selected_cca3, country)
+            st.session_state['map_cca3'] = selected_cca3
+        fmap = st.session_state['map_obj']
+        if fmap is not None:
+            # st_folium renders into the map's figure (markers re-append scripts), so it gets a
+            # throwaway copy; returned_objects=[]: the map is display-only, no interaction round-trip
+            st_folium(copy.deepcopy(fmap), width='100%', height=500, returned_objects=[],
+                      key=f"map_{selected_cca3}")
         else:
-            folium.Marker(location=[centroid.y, centroid.x], popup=f"Capital (approx.): {capital_name}", icon=folium.Icon(
-                color="gray", icon="question-sign")).add_to(fmap)
+            st.warning("Геометрии для страны не найдены в GeoJSON.")
 
-        Geocoder().add_to(fmap)
-        Fullscreen().add_to(fmap)
-        Draw(export=False).add_to(fmap)
-        MiniMap(position="bottomright").add_to(fmap)
+    st.markdown("with love 💘 by Behzod Khidirov.")
 
-        st_folium(fmap, width='100%', height=500)
-    else:
-        st.warning("Геометрии для страны не найдены в GeoJSON.")
 
-    st.markdown("with love 💘 by Behzod Khidirov.")
+with tabs[1]:
+    render_country_details()
 
 # ---------------------------- Compare Countries (REDESIGN) ----------------------------
 with tabs[0]:
@@ -393,16 +685,12 @@ with tabs[0]:
         "Выберите несколько стран, и для каждой страны будут показаны те же карточки и графики, что и в деталях.")
 
     # selection controls
-    df_sorted = df.sort_values(by='name_common')
-    country_map = dict(zip(df_sorted['name_common'], df_sorted['cca3']))
-    country_names = df_sorted['name_common'].tolist()
-
     default = [c for c in ['Netherlands', 'United Kingdom',
-                           'Germany'] if c in country_names]
+                           'Germany'] if c in NAME_TO_CCA3]
     if not default:
-        default = country_names[:3]
+        default = COUNTRY_NAMES[:3]
     selected_names = st.multiselect(
-        "Выберите страны (несколько)", country_names, default=default)
+        "Выберите страны (несколько)", COUNTRY_NAMES, default=default)
 
     if not selected_names:
         st.warning("Пожалуйста, выберите как минимум одну страну для сравнения.")
@@ -415,17 +703,13 @@ with tabs[0]:
             f"Слишком много стран для одновременного показа — пожалуйста, выберите не более {MAX_COUNTRIES} стран.")
         selected_names = selected_names[:MAX_COUNTRIES]
 
-    selected_cca3_list = [country_map[n] for n in selected_names]
-    selected_df = df[df['cca3'].isin(selected_cca3_list)]
+    selected_cca3_list = [NAME_TO_CCA3[n] for n in selected_names]
 
-    # load restcountries data and worldbank data for each selected
-    restcountries = {}
-    wb_by_country = {}
-    for cca3 in selected_cca3_list:
-        restcountries[cca3] = get_country_data_by_cca3(cca3) or {}
-        cca2 = df[df['cca3'] == cca3]['cca2'].values[0]
-        wb_by_country[cca3] = load_worldbank_from_db(
-            cca2) if cca2 is not None else pd.DataFrame()
+    # restcountries record per selected country
+    restcountries = {cca3: get_country_data_by_cca3(cca3) or {} for cca3 in selected_cca3_list}
+
+    # worldbank data for all selected countries is queried in bulk by the cached loaders below
+    cca2_list = [CCA3_TO_CCA2[c] for c in selected_cca3_list if CCA3_TO_CCA2.get(c)]
 
     st.markdown("---")
 
@@ -433,7 +717,7 @@ with tabs[0]:
     st.subheader("Флаги и гербы выбранных стран")
     cols = st.columns(len(selected_names))
     for i, name in enumerate(selected_names):
-        cca3 = country_map[name]
+        cca3 = NAME_TO_CCA3[name]
         rc = restcountries.get(cca3, {})
         with cols[i]:
             flag = rc.get('flags', {}).get('png')
@@ -460,19 +744,15 @@ with tabs[0]:
     table_index = table_rows + extra_rows
 
     latest_table = pd.DataFrame(index=table_index)
+    latest_wide = latest_indicators(
+        tuple(sorted(cca2_list)), tuple(card_indicators))
 
     for cca3 in selected_cca3_list:
-        name = df[df['cca3'] == cca3]['name_common'].values[0]
-        wb = wb_by_country.get(cca3, pd.DataFrame())
-        col_vals = []
+        name = CCA3_TO_NAME[cca3]
         # indicators
-        for ind in card_indicators:
-            val = None
-            if not wb.empty and 'indicator' in wb.columns:
-                t = wb[wb['indicator'] == ind].sort_values('year')
-                if not t.empty:
-                    val = t.iloc[-1]['value']
-            col_vals.append(val)
+        latest = latest_wide.get(CCA3_TO_CCA2.get(cca3))
+        col_vals = [latest.get(ind) if latest is not None else None
+                    for ind in card_indicators]
         # extra info from restcountries / df
         rc = restcountries.get(cca3, {})
         borders = ', '.join(rc.get('borders', [])
@@ -487,7 +767,7 @@ with tabs[0]:
             first = list(rc.get('currencies').items())[0]
             currency = f"{first[0]} — {first[1].get('name', '')} ({first[1].get('symbol', '')})"
         area = f"{int(rc.get('area')):,}" if rc.get('area') else (
-            f"{int(df[df['cca3'] == cca3]['area'].values[0]):,}" if not pd.isna(df[df['cca3'] == cca3]['area'].values[0]) else '—')
+            f"{int(CCA3_TO_AREA[cca3]):,}" if not pd.isna(CCA3_TO_AREA[cca3]) else '—')
         continents = ', '.join(rc.get('continents', [])
                                ) if rc.get('continents') else '—'
         capital = ', '.join(rc.get('capital', [])
@@ -513,18 +793,13 @@ with tabs[0]:
 
     # ------------------- Time series charts for each key indicator (mixed visuals + unified hover) -------------------
     st.subheader("📈 Сравнение ключевых индикаторов по годам")
-    combined = []
-    for cca3 in selected_cca3_list:
-        wb = wb_by_country.get(cca3, pd.DataFrame())
-        name = df[df['cca3'] == cca3]['name_common'].values[0]
-        if not wb.empty:
-            tmp = wb.copy()
-            tmp['country_name'] = name
-            combined.append(tmp)
-
-    if combined:
-        combined_df = pd.concat(combined, ignore_index=True)
-        indicators_list = combined_df['indicator'].unique().tolist()
+    series = load_indicator_series(tuple(sorted(cca2_list)))
+    # rows arrive grouped by country code; keep legends in selection order
+    country_order = {'country_name': selected_names}
+
+    if series:
+        indicators_list = sorted(series,
+                                 key=lambda ind: indicator_order.get(ind, len(indicator_order)))
         ordered = [i for i in card_indicators if i in indicators_list] + \
             [i for i in indicators_list if i not in card_indicators]
 
@@ -533,24 +808,9 @@ with tabs[0]:
             for j in range(3):
                 if i + j < len(ordered):
                     ind = ordered[i + j]
-                    title_map = {
-                        'gdp_current_usd': '💰 ВВП (текущий, USD)',
-                        'gdp_per_capita': '👤 ВВП на душу населения',
-                        'gdp_growth_percent': '📈 Рост ВВП (%)',
-                        'inflation_percent': '🔥 Инфляция (%)',
-                        'unemployment_percent': '📉 Безработица (%)',
-                        'population_total': '👥 Население',
-                        'imports_usd': '📦 Импорт (USD)',
-                        'exports_usd': '🚢 Экспорт (USD)',
-                        'exports_pct_gdp': '📊 Экспорт (% ВВП)',
-                        'imports_pct_gdp': '📊 Импорт (% ВВП)',
-                        'current_account_pct_gdp': '💼 Текущий счёт (% ВВП)',
-                        'capital_formation_pct_gdp': '🏗️ Капитальные вложения (% ВВП)',
-                        'govt_expenditure_pct_gdp': '🏛️ Госрасходы (% ВВП)'
-                    }
-                    title = title_map.get(
+                    title = indicator_titles.get(
                         ind, ind.replace('_', ' ').capitalize())
-                    chart_df = combined_df[combined_df['indicator'] == ind]
+                    chart_df = series.get(ind, pd.DataFrame())
                     with cols[j]:
                         st.subheader(title)
                         if chart_df.empty:
@@ -559,16 +819,19 @@ with tabs[0]:
                             # choose visual type per indicator
                             if ind in ['gdp_growth_percent', 'inflation_percent', 'unemployment_percent']:
                                 fig = px.bar(
-                                    chart_df, x='year', y='value', color='country_name', barmode='group')
+                                    chart_df, x='year', y='value', color='country_name', barmode='group',
+                                    category_orders=country_order)
                             elif ind in ['population_total']:
                                 fig = px.area(chart_df, x='year',
-                                              y='value', color='country_name')
+                                              y='value', color='country_name', category_orders=country_order)
                             elif ind in ['gdp_current_usd', 'imports_usd', 'exports_usd']:
                                 fig = px.bar(
-                                    chart_df, x='year', y='value', color='country_name', barmode='group')
+                                    chart_df, x='year', y='value', color='country_name', barmode='group',
+                                    category_orders=country_order)
                             else:
                                 fig = px.line(
-                                    chart_df, x='year', y='value', color='country_name', markers=True)
+                                    chart_df, x='year', y='value', color='country_name', markers=True,
+                                    category_orders=country_order)
 
                             # unified hover so the vertical hover line shows all countries' values at a year
                             fig.update_layout(height=380, margin=dict(
@@ -588,37 +851,21 @@ with tabs[0]:
 
     # ------------------- Compare GDP + % growth mixed chart (per-country) -------------------
     st.subheader('💰 ВВП и % прироста (сравнение стран)')
-    # prepare per-country GDP by year and pct change per country
-    gdp_list = []
-    for cca3 in selected_cca3_list:
-        wb = wb_by_country.get(cca3, pd.DataFrame())
-        name = df[df['cca3'] == cca3]['name_common'].values[0]
-        if not wb.empty and 'indicator' in wb.columns:
-            tmp = wb[wb['indicator'] == 'gdp_current_usd'][[
-                'year', 'value']].copy()
-            if not tmp.empty:
-                tmp['country_name'] = name
-                gdp_list.append(tmp)
-
-    if gdp_list:
-        gdp_df = pd.concat(gdp_list, ignore_index=True)
-        # compute pct change per country
-        gdp_df = gdp_df.sort_values(['country_name', 'year'])
-        gdp_df['pct_change'] = gdp_df.groupby(
-            'country_name')['value'].pct_change() * 100
-
-        years = sorted(gdp_df['year'].unique())
+    # per-country GDP by year with pct change already computed in SQL
+    gdp_df = load_gdp_growth(tuple(sorted(cca2_list)))
+
+    if not gdp_df.empty:
+        gdp_by_country = list(gdp_df.groupby(
+            gdp_df['country_code'].map(CCA2_TO_NAME)))
         fig = go.Figure()
 
         # add GDP bars per country (grouped by year)
-        for name in gdp_df['country_name'].unique():
-            sub = gdp_df[gdp_df['country_name'] == name]
+        for name, sub in gdp_by_country:
             fig.add_trace(go.Bar(
                 x=sub['year'], y=sub['value'], name=f'{name} — ВВП (USD)', hovertemplate='%{x}: %{y:,.0f}<extra></extra>'))
 
         # add pct change lines per country on secondary axis
-        for name in gdp_df['country_name'].unique():
-            sub = gdp_df[gdp_df['country_name'] == name]
+        for name, sub in gdp_by_country:
             fig.add_trace(go.Scatter(x=sub['year'], y=sub['pct_change'],
                           name=f'{name} — % прироста', yaxis='y2', mode='lines+markers', hovertemplate='%{x}: %{y:.2f}%<extra></extra>'))
 
@@ -641,17 +888,19 @@ with tabs[0]:
 
     # ------------------- Map -------------------
     st.subheader('🗺️ Карта — выбранные страны')
-    geo_sel = geo_data[geo_data['iso_a3'].isin(selected_cca3_list)]
-    if not geo_sel.empty:
-        geo_sel = geo_sel.to_crs(epsg=4326)
-        bounds = geo_sel.total_bounds
-        minx, miny, maxx, maxy = bounds[0], bounds[1], bounds[2], bounds[3]
+    import folium
+    from folium.plugins import Geocoder, MiniMap, Fullscreen, Draw
+    from streamlit_folium import st_folium
+
+    geo_sel = get_countries_geo(tuple(selected_cca3_list))
+    if geo_sel:
+        minx, miny, maxx, maxy = geo_sel["bounds"]
         center_lat = (miny + maxy) / 2
         center_lon = (minx + maxx) / 2
 
         fmap = folium.Map(location=[center_lat, center_lon], zoom_start=3)
-        folium.GeoJson(geo_sel, name='Selected countries', tooltip=folium.GeoJsonTooltip(
-            fields=['name'] if 'name' in geo_sel.columns else [])).add_to(fmap)
+        folium.GeoJson(geo_sel["geojson"], name='Selected countries', tooltip=folium.GeoJsonTooltip(
+            fields=geo_sel["tooltip_fields"])).add_to(fmap)
 
         # capitals
         for cca3 in selected_cca3_list:
@@ -659,7 +908,7 @@ with tabs[0]:
             capital_coord = rc.get('capitalInfo', {}).get('latlng')
             cap_name = ', '.join(rc.get('capital', [])) if rc.get(
                 'capital') else None
-            country_name = df[df['cca3'] == cca3]['name_common'].values[0]
+            country_name = CCA3_TO_NAME[cca3]
             if capital_coord:
                 folium.Marker(location=capital_coord, popup=f"{country_name} — {cap_name}", icon=folium.Icon(
                     icon='flag')).add_to(fmap)
@@ -670,7 +919,8 @@ with tabs[0]:
         Draw(export=False).add_to(fmap)
         MiniMap(position='bottomright').add_to(fmap)
 
-        st_folium(fmap, width="100%", height=600)
+        st_folium(fmap, width="100%", height=600, returned_objects=[],
+                  key=f"compare_map_{'_'.join(selected_cca3_list)}")
     else:
         st.warning('Геометрии для выбранных стран не найдены в GeoJSON.')
 